@@ -6,8 +6,9 @@ import os
 
 from dominate.tags import p, pre
 from dominate.util import raw
+from ezcharts.components import bcfstats
 from ezcharts.components.ezchart import EZChart
-from ezcharts.components.fastcat import load_stats, SeqSummary
+from ezcharts.components.fastcat import SeqSummary
 from ezcharts.components.reports import labs
 from ezcharts.layout.snippets import Stats, Tabs
 from ezcharts.layout.snippets.table import DataTable
@@ -104,6 +105,9 @@ The assembly was generated using <a href="https://github.com/marbl/canu">Canu</a
             qc_df = qc_df.rename(columns={
                 'sample_name': 'Sample', 'mean_quality': 'Mean Quality'})
             qc_df = qc_df.reset_index(drop=True)
+            # Sample names from the status file are strings, numeric
+            # aliases are read as ints here
+            qc_df['Sample'] = qc_df['Sample'].astype(str)
             merged = pd.merge(merged, qc_df, how="outer")
             merged.fillna('N/A', inplace=True)
             merged['pass/failed reason'] = merged.apply(
@@ -169,8 +173,7 @@ if a host reference was provided.
                     fastcat_tabs = fastcat_dic[item]
                     for key, value in fastcat_tabs.items():
                         with internal_tabs.add_tab(key):
-                            stats = load_stats(value, format="fastcat")
-                            depth = len(stats.index)
+                            depth = report_utils.count_stats_rows(value)[1]
                             Stats(
                                 columns=2,
                                 items=[
@@ -182,13 +185,10 @@ if a host reference was provided.
         inserts = json.load(open(args.inserts_json))
         with report.add_section("Insert sequences", "Inserts"):
             seq_segment = pd.read_json(inserts['bed_df'])
+            seq_segment['Sample'] = seq_segment['Sample'].astype(str)
             insert_df = seq_segment.merge(stats_df, how='left')
-            insert_df['Insert length'] = list(
-                map(
-                    report_utils.insert_len,
-                    insert_df['start'],
-                    insert_df['end'],
-                    insert_df['Length']))
+            insert_df['Insert length'] = report_utils.insert_len_batch(
+                insert_df['start'], insert_df['end'], insert_df['Length'])
             insert_df = insert_df.drop(columns='Length')
             p("""
 This table shows which primers were found in the consensus sequence
@@ -212,9 +212,12 @@ finding any variants between
 the consensus insert and the provided reference
 insert.
 """)
-            variants_df = report_utils.variant_counts_table(args.qc_inserts, report)
+            bcf_stats = bcfstats.load_bcfstats(args.qc_inserts)
+            variants_df = report_utils.variant_counts_table(
+                args.qc_inserts, report, parsed=bcf_stats)
             DataTable.from_pandas(variants_df, use_index=False)
-            trans_df = report_utils.trans_counts(args.qc_inserts, report)
+            trans_df = report_utils.trans_counts(
+                args.qc_inserts, report, parsed=bcf_stats)
             DataTable.from_pandas(trans_df, use_index=False)
     # dot plots
     if ('OPTIONAL_FILE' not in os.listdir(args.mafs)):
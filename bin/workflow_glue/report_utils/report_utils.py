@@ -1,5 +1,13 @@
 #!/usr/bin/env python
 """Create tables for the report."""
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import functools
+import gzip
+import mmap
+import os
+from pathlib import PurePath
+import re
 
 from bokeh.models import ColumnDataSource, Segment
 from bokeh.plotting import figure
@@ -7,52 +15,112 @@ from dominate.tags import p
 import ezcharts as ezc
 from ezcharts.components import bcfstats, ezchart
 from ezcharts.plots.util import Colors
+import numpy as np
 import pandas as pd
 
 
 THEME = 'epi2melabs'
+# Placeholders staged when optional fastcat stats are not available
+OPTIONAL_FILES = {
+    'host_filter_stats/OPTIONAL_FILE', 'downsampled_stats/OPTIONAL_FILE'}
+# Suffixes of the fastcat stats files following the sample name
+FASTCAT_SUFFIXES = ('.stats.gz', '.stats')
 
 
 def tidyup_status_file(status_sheet, annotations):
     """Tidy up the sample status file."""
-    sample_status = pd.read_csv(status_sheet[0], header=None)
-    unique_samples = sample_status[0].unique()
-    sample_status_dic = {}
+    with open(status_sheet[0], newline='') as status_file:
+        sample_status = [row for row in csv.reader(status_file) if row]
+    # Keep samples in order of first appearance
+    unique_samples = list(dict.fromkeys(row[0] for row in sample_status))
     # Default all to success
-    for sample in unique_samples:
-        sample_status_dic[sample] = 'Completed successfully'
-    filter_pass = sample_status[sample_status[1] != 'Completed successfully']
-    # Collect failures
-    failures = dict(zip(filter_pass[0], filter_pass[1]))
-    completed_annotations = list(annotations)
-    # If no failure for a sample status sheet then success
-    success = sample_status[sample_status[1] == 'Completed successfully']
-    # Check for corresponding annotations, if none update status
-    no_annotations = success[~success[0].isin(completed_annotations)]
-    for sample in list(no_annotations[0]):
+    sample_status_dic = dict.fromkeys(unique_samples, 'Completed successfully')
+    completed_annotations = set(annotations)
+    failures = {}
+    no_annotations = []
+    for sample, status in (row[:2] for row in sample_status):
+        if status != 'Completed successfully':
+            # Collect failures
+            failures[sample] = status
+        elif sample not in completed_annotations:
+            # If no failure for a sample status sheet then success,
+            # check for corresponding annotations, if none update status
+            no_annotations.append(sample)
+    for sample in no_annotations:
         failures[sample] = 'Completed but no annotations found in the database'
-    passed_list = unique_samples.tolist()
     # Update sample status dictionary with any failure messages
     # Also create a list of passed samples to iterate through later
-    for k, v in failures.items():
-        sample_status_dic[k] = v
-        if v != 'Completed but failed to reconcile':
-            passed_list.remove(k)
-    passed_list.sort()
+    sample_status_dic.update(failures)
+    failed = {
+        k for k, v in failures.items()
+        if v != 'Completed but failed to reconcile'}
+    # Names are kept as strings, but aliases that are all numbers are
+    # still ordered by value
+    sort_key = int if all(s.isdigit() for s in unique_samples) else None
+    passed_list = sorted(set(unique_samples) - failed, key=sort_key)
     # Output list of all sample names
-    all_sample_names = unique_samples.tolist()
-    all_sample_names.sort()
+    all_sample_names = sorted(unique_samples, key=sort_key)
     return (passed_list, all_sample_names, sample_status_dic)
 
 
+def count_stats_rows(summary_fn):
+    """Get the sample name and number of reads in a fastcat stats file.
+
+    Only the first row is parsed, the remaining rows are counted
+    without being split into fields. Results are cached so files
+    unchanged since a previous call are not read again.
+
+    :param summary_fn: fastcat per-read stats file, optionally gzipped.
+
+    :returns: tuple of sample name and read count, the sample name is
+        `None` for a file with no reads.
+    """
+    stat = os.stat(summary_fn)
+    return _count_stats_rows_cached(summary_fn, stat.st_mtime, stat.st_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _count_stats_rows_cached(summary_fn, mtime, size):
+    """Count fastcat stats rows, cached on path, mtime and size."""
+    opener = gzip.open if summary_fn.endswith('.gz') else open
+    with opener(summary_fn, 'rb') as summary:
+        header = summary.readline().rstrip(b'\r\n').split(b'\t')
+        first_row = summary.readline()
+        if not first_row.strip():
+            # header only, e.g. when host filtering removed every read
+            return None, 0
+        sample_id = first_row.rstrip(b'\r\n').split(b'\t')[
+            header.index(b'sample_name')].decode()
+        # Count the remaining rows in chunks as `wc -l` does, less any
+        # blank lines (a newline following a newline) as pandas skips them
+        n_rows = first_row.count(b'\n')
+        last = first_row[-1:]
+        for chunk in iter(lambda: summary.read(1 << 20), b''):
+            n_rows += chunk.count(b'\n')
+            # a blank line may start at the end of the previous chunk
+            if chunk[:1] == b'\n' and last == b'\n':
+                n_rows -= 1
+            blank = chunk.find(b'\n\n')
+            while blank != -1:
+                n_rows -= 1
+                blank = chunk.find(b'\n\n', blank + 1)
+            last = chunk[-1:]
+    # last row without a trailing newline
+    if last != b'\n':
+        n_rows += 1
+    return sample_id, n_rows
+
+
 def read_count_barplot(per_barcode_stats, report):
     """Plot per sample read count bar chart."""
     # Per barcode read count
-    readcounts = {}
-    for summary_fn in per_barcode_stats:
-        df_sample = pd.read_csv(summary_fn, sep="\t")
-        sample_id = df_sample['sample_name'].iloc[0]
-        readcounts[sample_id] = df_sample.shape[0]
+    # Files are read and decompressed in parallel, reading releases the GIL
+    n_workers = max(1, min(32, len(per_barcode_stats)))
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        readcounts = {
+            sample_id: n_rows for sample_id, n_rows
+            in executor.map(count_stats_rows, per_barcode_stats)
+            if sample_id is not None}
     barcode_counts = pd.DataFrame.from_dict(
         readcounts, orient='index', columns=['Count'])
     barcode_counts = barcode_counts.sort_index().reset_index().rename(
@@ -85,42 +153,70 @@ def insert_len(start, end, length):
     return insert_length
 
 
+def insert_len_batch(starts, ends, lengths):
+    """Insert length calc for arrays of inserts.
+
+    Vectorised equivalent of `insert_len`, lengths are only used for
+    inserts spanning the origin.
+    """
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+    lengths = np.asarray(lengths)
+    insert_lengths = ends - starts
+    wrapped = ends < starts
+    if wrapped.any():
+        # infer the type from the values, as a column built from the
+        # scalar results would, so only missing lengths of wrapped
+        # inserts give floats (NaN)
+        wrapped_lengths = np.asarray((
+            (lengths[wrapped] - starts[wrapped]) + ends[wrapped]).tolist())
+        insert_lengths = insert_lengths.astype(
+            np.result_type(insert_lengths, wrapped_lengths))
+        insert_lengths[wrapped] = wrapped_lengths
+    return insert_lengths
+
+
+def _index_by_sample(fc_list):
+    """Index fastcat stats files by the sample name prefixing the file name.
+
+    Matching on the exact name avoids e.g. `sample1` also matching the
+    files of `sample10`, and names containing dots are kept whole.
+    """
+    by_sample = {}
+    for path in fc_list:
+        name = PurePath(path).name
+        for suffix in FASTCAT_SUFFIXES:
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+                break
+        by_sample.setdefault(name, path)
+    return by_sample
+
+
 def create_fastcat_dic(sample_names, raw, host_file, downsampled_file):
     """Create dictionary using sample names and fastcat files available."""
     # Collect per sample fastcat stats check no optional files
-    if ('host_filter_stats/OPTIONAL_FILE' in host_file):
-        host_filt = host_file.remove('host_filter_stats/OPTIONAL_FILE')
-        if host_filt is None:
-            host_filt = []
-    else:
-        host_filt = host_file
-    if ('downsampled_stats/OPTIONAL_FILE' in downsampled_file):
-        summary_stats = downsampled_file.remove(
-            'downsampled_stats/OPTIONAL_FILE')
-        if summary_stats is None:
-            summary_stats = []
-    else:
-        summary_stats = downsampled_file
+    host_filt = [p for p in (host_file or ()) if p not in OPTIONAL_FILES]
+    summary_stats = [
+        p for p in (downsampled_file or ()) if p not in OPTIONAL_FILES]
+    lists = {
+        'Raw': _index_by_sample(raw),
+        'Hostfilt': _index_by_sample(host_filt),
+        'Downsampled': _index_by_sample(summary_stats)}
     per_sample_dic = {}
-    lists = {'Raw': raw, 'Hostfilt': host_filt, 'Downsampled': summary_stats}
     for sample in sample_names:
         new_dic = {}
-        item_search = '/' + str(sample) + '.'
-        for list_name, fc_list in lists.items():
-            #  find index of item that contains the sample name as a substring
-            item_index = [i for i, s in enumerate(fc_list) if item_search in s]
-            if item_index:
-                indice = item_index[0]
-                new_dic[list_name] = fc_list[indice]
-            else:
-                pass
+        for list_name, fc_files in lists.items():
+            fc_file = fc_files.get(str(sample))
+            if fc_file is not None:
+                new_dic[list_name] = fc_file
         per_sample_dic[sample] = new_dic
     return per_sample_dic
 
 
 def variant_counts_table(
         bcf_stats,
-        header="**Variant counts:**", report=None):
+        header="**Variant counts:**", report=None, parsed=None):
     """Create a report section contains variant counts.
 
     :param bcf_stats: one or more outputs from `bcftools stats`.
@@ -128,40 +224,87 @@ def variant_counts_table(
         sample into a column.
     :param header: a markdown formatted header.
     :param report: an HTMLSection instance.
+    :param parsed: output of `bcfstats.load_bcfstats` for `bcf_stats`, if
+        already loaded.
 
     :returns: an HTMLSection instance, if `report` was provided the given
         instance is modified and returned.
     """
-    bcf_stats = bcfstats.load_bcfstats(bcf_stats)
+    if parsed is None:
+        parsed = bcfstats.load_bcfstats(bcf_stats)
     p("""
 Variant counts per sample. See output bcf
 file for info on individual variants.
 """)
-    df = bcf_stats['SN'].drop(columns='samples')
+    summary = parsed['SN']
+    df = summary[[col for col in summary.columns if col != 'samples']]
     return df
 
 
 def trans_counts(
         bcf_stats,
-        header="**Transitions and tranversions:**", report=None):
+        header="**Transitions and tranversions:**", report=None,
+        parsed=None):
     """Create a report section with transition and transversion counts.
 
     :param bcf_stats: one or more outputs from `bcftools stats`.
     :param header: a markdown formatted header.
     :param report: an HTMLSection instance.
+    :param parsed: output of `bcfstats.load_bcfstats` for `bcf_stats`, if
+        already loaded.
 
     :returns: an HTMLSection instance, if `report` was provided the given
         instance is modified and returned.
     """
-    bcf_stats = bcfstats.load_bcfstats(bcf_stats)
+    if parsed is None:
+        parsed = bcfstats.load_bcfstats(bcf_stats)
     p("""
 Trans counts per sample.
 See output bcf file for info on individual transitions.
 """)
-    df = bcf_stats['TSTV']
+    df = parsed['TSTV']
     return df
 
 
+# start, size and strand of a sequence line
+_MAF_SEQUENCE = (
+    rb's[ \t]+\S+[ \t]+(\d+)[ \t]+(\d+)[ \t]+([+-])[^\n]*(?:\n|\Z)')
+# an 'a' line followed by the reference and query 's' lines
+_MAF_BLOCK = re.compile(
+    rb'^a[^\n]*\n' + _MAF_SEQUENCE + _MAF_SEQUENCE, re.MULTILINE)
+# comment lines and alignment blocks, each block is terminated by one
+# further (usually blank) line
+_MAF_FILE = re.compile(
+    rb'(?:#[^\n]*(?:\n|\Z)|a[^\n]*\n'
+    + _MAF_SEQUENCE + _MAF_SEQUENCE + rb'[^\n]*(?:\n|\Z))*')
+_MAF_LETTERS = re.compile(rb'^#.*letters=(\d+)', re.MULTILINE)
+
+
+def _parse_maf_alignments(maf_buffer):
+    """Parse reference and query coordinates of maf alignment blocks.
+
+    Each alignment block is made up of an 'a' line followed by two
+    's' lines, the first for the reference and the second for the query,
+    and a terminating line. Only comment lines may appear between blocks.
+
+    :param maf_buffer: contents of a .maf file as a bytes-like object.
+
+    :returns: start, length and orientation (as `S1` bytes) arrays for
+        the reference followed by the same for the query.
+    """
+    if _MAF_FILE.fullmatch(maf_buffer) is None:
+        raise IOError("Cannot read alignment file")
+    fields = np.array(
+        _MAF_BLOCK.findall(maf_buffer), dtype=bytes).reshape(-1, 6)
+    # convert all the coordinates at once rather than field by field,
+    # keeping one contiguous array per column
+    coords = fields[:, [0, 1, 3, 4]].astype(np.int64)
+    orients = fields[:, [2, 5]].astype('S1')
+    return tuple(np.ascontiguousarray(column) for column in (
+        coords[:, 0], coords[:, 1], orients[:, 0],
+        coords[:, 2], coords[:, 3], orients[:, 1]))
+
+
 def dotplot_assembly(maf_assembly):
     """Dotplot of assembly using a .maf format file."""
     # Create a bokeh plot
@@ -170,57 +313,53 @@ def dotplot_assembly(maf_assembly):
         min_border=0, x_axis_label="position",
         y_axis_label="position", title="Dot plot")
     plot.toolbar_location = None
-    # Iterate through maf file to create a dataframe
-    records = list()
-    with open(f"mafs/{maf_assembly}") as maf:
-        while True:
-            line = maf.readline()
-            if line.startswith('#'):
-                # get read length
-                if 'letters' in line:
-                    read_length = int(line.split('letters=')[1])
-                    continue
-                else:
-                    continue
-            # a is for each alignment
-            elif line.startswith('a'):
-                # take successive 's' lines
-                r1 = maf.readline().split()[1:5]
-                r2 = maf.readline().split()[1:5]
-                maf.readline()
-                records.append(r1 + r2)
-            elif line == "":
-                break
-            else:
+    # Memory map the maf file and scan it in place rather than reading
+    # it line by line
+    with open(f"mafs/{maf_assembly}", 'rb') as maf:
+        if os.fstat(maf.fileno()).st_size == 0:
+            raise IOError("Cannot read alignment file")
+        with mmap.mmap(maf.fileno(), 0, access=mmap.ACCESS_READ) as maf_buffer:
+            # get read length before parsing the alignments, only
+            # searching the header ahead of the first alignment block.
+            # As with the original line by line parser the last value
+            # given is used.
+            header_end = maf_buffer.find(b'\na')
+            if header_end == -1:
+                header_end = len(maf_buffer)
+            letters = _MAF_LETTERS.findall(maf_buffer, 0, header_end)
+            if not letters:
                 raise IOError("Cannot read alignment file")
-    # take reference start, length and orientation
-    # and query start, length and orientation
-    names = [
-        'ref', 'rstart', 'rlen', 'rorient',
-        'query', 'qstart', 'qlen', 'qorient']
-    df_all = pd.DataFrame(records, columns=names)
-    df_all = df_all.astype({'qstart': int, 'qlen': int, 'rstart': int, 'rlen': int})
+            read_length = int(letters[-1])
+            rstart, rlen, rorient, qstart, qlen, qorient = \
+                _parse_maf_alignments(maf_buffer)
     # If query orientation is +
-    df = df_all[df_all.qorient.isin(['+'])]
-    # create query and ref end columns by adding length to start
-    df['qend'] = df['qstart'] + df['qlen']
-    df.loc[df['rorient'] == '+', 'rend'] = df['rstart'] + df['rlen']
+    fwd = qorient == b'+'
+    fwd_rstart = rstart[fwd]
+    fwd_rlen = rlen[fwd]
+    # create query and ref end by adding length to start
+    fwd_qstart = qstart[fwd]
+    fwd_qend = fwd_qstart + qlen[fwd]
     # If reference orientation is negative switch reference start and end
-    df.loc[df['rorient'] == '-', 'rend'] = df['rstart']
-    df.loc[df['rorient'] == '-', 'rstart'] = df['rstart'] - df['rlen']
-    # Add fwd lines to plot
-    source = ColumnDataSource(df)
-    glyph = Segment(x0='rstart', y0='qstart', x1='rend', y1='qend', line_color="black")
-    plot.add_glyph(source, glyph)
+    rrev = rorient[fwd] == b'-'
+    fwd_rend = np.where(rrev, fwd_rstart, fwd_rstart + fwd_rlen)
+    fwd_rstart = np.where(rrev, fwd_rstart - fwd_rlen, fwd_rstart)
     # if query orientation is -
-    df = df_all[df_all.qorient.isin(['-'])]
+    rev = qorient == b'-'
     # If the orientation is "-", start coordinate is in the reverse strand (maf docs)
     # Therefore as plot will be + vs + query start needs to be flipped
-    df['qstart'] = read_length - df['qstart']
-    df['qend'] = df['qstart'] - df['qlen']
-    df['rend'] = df['rstart'] + df['rlen']
-    # Add reverse complement lines to plot
-    source = ColumnDataSource(df)
-    glyph = Segment(x0='rstart', y0='qstart', x1='rend', y1='qend', line_color="red")
+    rev_qstart = read_length - qstart[rev]
+    rev_qend = rev_qstart - qlen[rev]
+    rev_rstart = rstart[rev]
+    rev_rend = rev_rstart + rlen[rev]
+    # Add fwd (black) and reverse complement (red) lines to plot from a
+    # single source with a colour column
+    color = np.array(['black'] * len(fwd_rstart) + ['red'] * len(rev_rstart))
+    source = ColumnDataSource(data=dict(
+        rstart=np.concatenate([fwd_rstart, rev_rstart]),
+        qstart=np.concatenate([fwd_qstart, rev_qstart]),
+        rend=np.concatenate([fwd_rend, rev_rend]),
+        qend=np.concatenate([fwd_qend, rev_qend]),
+        color=color))
+    glyph = Segment(x0='rstart', y0='qstart', x1='rend', y1='qend', line_color='color')
     plot.add_glyph(source, glyph)
     return plot
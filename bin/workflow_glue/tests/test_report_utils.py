@@ -0,0 +1,194 @@
+"""Test report_utils.py."""
+import gzip
+
+import numpy as np
+import pandas as pd
+import pytest
+from workflow_glue.report_utils import report_utils
+
+
+MAF_HEADER = "# LAST version 1\n# letters=1000\n#\n"
+MAF_BLOCKS = """a score=100
+s ctg 10 50 + 1000 ACGT
+s ctg 20 50 + 1000 ACGT
+
+a score=90
+s ctg 100 30 - 1000 ACGT
+s ctg 200 30 + 1000 ACGT
+
+a score=90
+s ctg 300 40 + 1000 ACGT
+s ctg 400 40 - 1000 ACGT
+
+"""
+
+# Expected (rstart, qstart, rend, qend) per line colour, as produced by the
+# original line by line maf parser
+EXPECTED_DOTPLOT = [
+    (
+        MAF_HEADER + MAF_BLOCKS,
+        {
+            'black': [[10, 70], [20, 200], [60, 100], [70, 230]],
+            'red': [[300], [600], [340], [560]]}),
+    # the last letters= value in the header is used
+    (
+        MAF_HEADER + "# letters=2000\n" + MAF_BLOCKS,
+        {
+            'black': [[10, 70], [20, 200], [60, 100], [70, 230]],
+            'red': [[300], [1600], [340], [1560]]}),
+    # no alignments
+    (MAF_HEADER, {'black': [[], [], [], []], 'red': [[], [], [], []]}),
+]
+
+BAD_MAFS = [
+    # blank line between alignment blocks
+    MAF_HEADER + MAF_BLOCKS.replace("\n\na", "\n\n\na", 1),
+    # unknown line type
+    MAF_HEADER + "x unexpected\n" + MAF_BLOCKS,
+    # alignment missing its query line
+    MAF_HEADER + "a score=100\ns ctg 10 50 + 1000 ACGT\n\n",
+    # no read length in header
+    MAF_BLOCKS,
+    # empty file
+    "",
+]
+
+
+@pytest.fixture
+def mafs(tmp_path, monkeypatch):
+    """Write a maf file into a mafs directory of the working directory."""
+    (tmp_path / "mafs").mkdir()
+    monkeypatch.chdir(tmp_path)
+
+    def write(contents):
+        (tmp_path / "mafs" / "sample.maf").write_text(contents)
+        return "sample.maf"
+    return write
+
+
+@pytest.mark.parametrize("maf,expected", EXPECTED_DOTPLOT)
+def test_dotplot_assembly(mafs, maf, expected):
+    """Test dot plot coordinates match those of the original parser."""
+    plot = report_utils.dotplot_assembly(mafs(maf))
+    (renderer,) = plot.renderers
+    data = renderer.data_source.data
+    color = np.asarray(data['color'])
+    for line_color, coords in expected.items():
+        selected = color == line_color
+        assert [
+            np.asarray(data[col])[selected].tolist()
+            for col in ('rstart', 'qstart', 'rend', 'qend')] == coords
+
+
+@pytest.mark.parametrize("maf", BAD_MAFS)
+def test_dotplot_assembly_bad_maf(mafs, maf):
+    """Test malformed maf files are rejected."""
+    with pytest.raises(IOError):
+        report_utils.dotplot_assembly(mafs(maf))
+
+
+def test_tidyup_status_file(tmp_path):
+    """Test sample statuses, passed and all sample lists."""
+    status = tmp_path / "final_status.csv"
+    status.write_text(
+        "s2,Completed successfully\n"
+        "s1,Completed successfully\n"
+        "s3,Failed due to insufficient reads\n"
+        "s4,Completed successfully\n"
+        "s4,Completed but failed to reconcile\n"
+        "\n"
+        "s5,Completed successfully\n")
+    passed, all_samples, statuses = report_utils.tidyup_status_file(
+        [str(status)], ['s1', 's2', 's4'])
+    assert passed == ['s1', 's2', 's4']
+    assert all_samples == ['s1', 's2', 's3', 's4', 's5']
+    assert statuses == {
+        's2': 'Completed successfully',
+        's1': 'Completed successfully',
+        's3': 'Failed due to insufficient reads',
+        's4': 'Completed but failed to reconcile',
+        's5': 'Completed but no annotations found in the database'}
+
+
+def test_tidyup_status_file_numeric(tmp_path):
+    """Test numeric sample aliases are ordered by value."""
+    status = tmp_path / "final_status.csv"
+    status.write_text(
+        "10,Completed successfully\n"
+        "2,Completed successfully\n"
+        "1,Completed successfully\n")
+    passed, all_samples, _ = report_utils.tidyup_status_file(
+        [str(status)], ['1', '2', '10'])
+    assert passed == ['1', '2', '10']
+    assert all_samples == ['1', '2', '10']
+
+
+def test_create_fastcat_dic():
+    """Test stats files are matched to the exact sample name."""
+    raw = [
+        'per_barcode_stats/sample10.stats.gz',
+        'per_barcode_stats/sample1.stats.gz',
+        'per_barcode_stats/s.1.stats.gz']
+    host = ['host_filter_stats/sample1.stats']
+    downsampled = [
+        'downsampled_stats/OPTIONAL_FILE']
+    fastcat_dic = report_utils.create_fastcat_dic(
+        ['sample1', 'sample10', 's.1', 'missing'], raw, host, downsampled)
+    assert fastcat_dic == {
+        'sample1': {
+            'Raw': 'per_barcode_stats/sample1.stats.gz',
+            'Hostfilt': 'host_filter_stats/sample1.stats'},
+        'sample10': {'Raw': 'per_barcode_stats/sample10.stats.gz'},
+        's.1': {'Raw': 'per_barcode_stats/s.1.stats.gz'},
+        'missing': {}}
+
+
+STATS_HEADER = "read_id\tsample_name\tread_length\n"
+EXPECTED_COUNTS = [
+    (STATS_HEADER + "r1\tbc01\t5\nr2\tbc01\t6\nr3\tbc01\t7\n", 3),
+    # no trailing newline
+    (STATS_HEADER + "r1\tbc01\t5\nr2\tbc01\t6\nr3\tbc01\t7", 3),
+    # blank lines are skipped, as with pandas
+    (STATS_HEADER + "r1\tbc01\t5\n\nr2\tbc01\t6\n\n\n", 2),
+    (STATS_HEADER + "r1\tbc01\t5\n", 1),
+    # header only, e.g. after host filtering removed every read
+    (STATS_HEADER, 0),
+]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("contents,expected", EXPECTED_COUNTS)
+def test_count_stats_rows(tmp_path, contents, expected, compress):
+    """Test sample name and read count of plain and gzipped stats."""
+    if compress:
+        stats = tmp_path / "bc01.stats.gz"
+        with gzip.open(stats, 'wt') as fh:
+            fh.write(contents)
+    else:
+        stats = tmp_path / "bc01.stats"
+        stats.write_text(contents)
+    sample_name = 'bc01' if expected else None
+    assert report_utils.count_stats_rows(str(stats)) == (sample_name, expected)
+
+
+INSERTS = [
+    # lengths as ints
+    ([10, 900, 5], [50, 20, 6], [1000, 1000, 2000]),
+    # missing length on an insert spanning the origin
+    ([10, 900, 5], [50, 20, 6], [1000, np.nan, 2000]),
+    # missing length on an insert not spanning the origin
+    ([10, 900, 5], [50, 20, 6], [np.nan, 1000, 2000]),
+    # 'N/A' length on an insert not spanning the origin
+    ([10, 900, 5], [50, 20, 6], [1000, 1000, 'N/A']),
+]
+
+
+@pytest.mark.parametrize("starts,ends,lengths", INSERTS)
+def test_insert_len_batch(starts, ends, lengths):
+    """Test batch insert lengths give the same column as insert_len."""
+    df = pd.DataFrame({'start': starts, 'end': ends, 'Length': lengths})
+    expected = pd.Series(list(map(
+        report_utils.insert_len, df['start'], df['end'], df['Length'])))
+    result = pd.Series(report_utils.insert_len_batch(
+        df['start'], df['end'], df['Length']))
+    pd.testing.assert_series_equal(result, expected)